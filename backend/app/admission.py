@@ -0,0 +1,276 @@
+"""Admission control and priority scheduling for contract analyses.
+
+Every analysis takes a slot before entering the pipeline. Slots are limited to
+what the model quota can serve (``ADMISSION_MAX_CONCURRENT``), and bulk work is
+further capped (``ADMISSION_MAX_BULK_CONCURRENT``) so interactive checks always
+have headroom. Waiting requests are queued per priority class; interactive
+requests are always dispatched before bulk ones, and within a class tenants
+are served round-robin so one tenant's backlog cannot starve the others.
+When a queue is saturated new requests are shed with ``QueueFullError``.
+"""
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+# Dispatch order: earlier classes always go first.
+PRIORITIES = (INTERACTIVE, BULK)
+
+DEFAULT_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "4"))
+DEFAULT_MAX_BULK_CONCURRENT = int(os.getenv("ADMISSION_MAX_BULK_CONCURRENT", "2"))
+DEFAULT_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "32"))
+DEFAULT_MAX_QUEUE_PER_TENANT = int(os.getenv("ADMISSION_MAX_QUEUE_PER_TENANT", "8"))
+# Initial guess for how long one analysis holds a slot, refined as analyses finish.
+DEFAULT_SERVICE_SECONDS = float(os.getenv("ADMISSION_SERVICE_SECONDS", "30"))
+# How often queued streams re-check their position.
+QUEUE_UPDATE_SECONDS = 1.0
+# Weight of the newest sample in the service time moving average.
+SERVICE_EWMA_ALPHA = 0.2
+# Retry-After for bulk requests while bulk work is disabled (ADMISSION_MAX_BULK_CONCURRENT=0).
+BULK_DISABLED_RETRY_SECONDS = 3600
+
+
+class QueueFullError(Exception):
+    """Raised when a request cannot be queued; carries a Retry-After hint."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+@dataclass(eq=False)
+class Ticket:
+    """A request's place in the admission queue (or its granted slot)."""
+
+    tenant: str
+    priority: str
+    granted: asyncio.Future
+    enqueued_at: float = field(default_factory=time.monotonic)
+    started_at: Optional[float] = None
+    released: bool = False
+
+    @property
+    def admitted(self) -> bool:
+        return self.started_at is not None
+
+    async def wait(self) -> None:
+        """Waits for a slot. Cancelling the waiter does not cancel the ticket."""
+        await asyncio.shield(self.granted)
+
+
+def _pop_round_robin(queue: "OrderedDict[str, Deque[Ticket]]") -> Ticket:
+    """Takes the next ticket from the first tenant and rotates that tenant to the back."""
+    tenant, tickets = next(iter(queue.items()))
+    ticket = tickets.popleft()
+    del queue[tenant]
+    if tickets:
+        queue[tenant] = tickets
+    return ticket
+
+
+class AdmissionController:
+    """Bounded, per-tenant fair, two-class admission queue."""
+
+    def __init__(
+        self,
+        max_concurrent: int = DEFAULT_MAX_CONCURRENT,
+        max_bulk_concurrent: int = DEFAULT_MAX_BULK_CONCURRENT,
+        max_queue: int = DEFAULT_MAX_QUEUE,
+        max_queue_per_tenant: int = DEFAULT_MAX_QUEUE_PER_TENANT,
+        service_seconds: float = DEFAULT_SERVICE_SECONDS,
+    ):
+        if max_concurrent < 1:
+            raise ValueError(f"max_concurrent must be at least 1, got {max_concurrent}")
+        if min(max_bulk_concurrent, max_queue, max_queue_per_tenant) < 0:
+            raise ValueError("Admission bulk concurrency and queue limits must not be negative")
+        self.max_concurrent = max_concurrent
+        # 0 disables bulk work: bulk requests are shed instead of queued forever.
+        self.max_bulk_concurrent = min(max_bulk_concurrent, max_concurrent)
+        self.max_queue = max_queue
+        self.max_queue_per_tenant = max_queue_per_tenant
+        self._queues: Dict[str, "OrderedDict[str, Deque[Ticket]]"] = {p: OrderedDict() for p in PRIORITIES}
+        self._running: Dict[str, int] = {p: 0 for p in PRIORITIES}
+        self._service_seconds: Dict[str, float] = {p: service_seconds for p in PRIORITIES}
+
+    # -- public API -------------------------------------------------------
+
+    def submit(self, tenant: str, priority: str = INTERACTIVE) -> Ticket:
+        """Grants a slot immediately or queues the request.
+
+        Raises ``QueueFullError`` if the request would exceed the queue limits.
+        """
+        self.check_capacity(tenant, priority)
+        ticket = Ticket(tenant=tenant, priority=priority, granted=asyncio.get_running_loop().create_future())
+
+        if self._can_start(priority) and not self._waiting_ahead(priority):
+            self._grant(ticket)
+            return ticket
+
+        self._queues[priority].setdefault(tenant, deque()).append(ticket)
+        logger.info(f"Queued {priority} analysis for tenant {tenant} at position {self.position(ticket)}")
+        return ticket
+
+    def check_capacity(self, tenant: str, priority: str = INTERACTIVE) -> None:
+        """Raises ``QueueFullError`` if ``submit`` would shed this request right now.
+
+        Lets callers turn a request away before spending any work on it; ``submit``
+        still makes the final decision.
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority class: {priority}")
+        if priority == BULK and self.max_bulk_concurrent == 0:
+            raise QueueFullError("Bulk analyses are disabled on this server.", BULK_DISABLED_RETRY_SECONDS)
+        if self._can_start(priority) and not self._waiting_ahead(priority):
+            return
+        if self.queued >= self.max_queue:
+            raise QueueFullError("Server is at capacity. Please retry later.", self._retry_after(priority))
+        if self._queued_for_tenant(tenant) >= self.max_queue_per_tenant:
+            raise QueueFullError("Too many queued analyses for this tenant.", self._retry_after(priority))
+
+    def release(self, ticket: Ticket) -> None:
+        """Frees a granted slot, or drops a ticket that is still queued. Idempotent."""
+        if ticket.released:
+            return
+        ticket.released = True
+        if ticket.admitted:
+            self._running[ticket.priority] -= 1
+            elapsed = time.monotonic() - ticket.started_at
+            average = self._service_seconds[ticket.priority]
+            self._service_seconds[ticket.priority] = average + SERVICE_EWMA_ALPHA * (elapsed - average)
+        else:
+            tickets = self._queues[ticket.priority].get(ticket.tenant)
+            if tickets is not None and ticket in tickets:
+                tickets.remove(ticket)
+                if not tickets:
+                    del self._queues[ticket.priority][ticket.tenant]
+            ticket.granted.cancel()
+        self._dispatch()
+
+    def position(self, ticket: Ticket) -> int:
+        """Number of queued requests that will be admitted before this one (0 = next)."""
+        if ticket.admitted:
+            return 0
+        order = self._dispatch_order()
+        return order.index(ticket) if ticket in order else 0
+
+    def estimated_wait(self, ticket: Ticket) -> float:
+        """Rough seconds until this ticket is admitted."""
+        if ticket.admitted:
+            return 0.0
+        position = self.position(ticket)
+        if ticket.priority == INTERACTIVE:
+            return round(self._wait_for(INTERACTIVE, position, 0), 1)
+        interactive_ahead = self._queued_in(INTERACTIVE)
+        return round(self._wait_for(BULK, interactive_ahead, position - interactive_ahead), 1)
+
+    async def wait_events(self, ticket: Ticket):
+        """Waits for a slot, yielding NDJSON ``queue`` events while queued."""
+        last_position = None
+        while not ticket.admitted and not ticket.released:
+            position = self.position(ticket)
+            if position != last_position:
+                last_position = position
+                yield json.dumps({"queue": {
+                    "priority": ticket.priority,
+                    "position": position + 1,
+                    "eta_seconds": self.estimated_wait(ticket),
+                }}) + "\n"
+            await asyncio.wait({ticket.granted}, timeout=QUEUE_UPDATE_SECONDS)
+        if last_position is not None:
+            waited = time.monotonic() - ticket.enqueued_at
+            yield json.dumps({"queue": {"priority": ticket.priority, "position": 0, "waited_seconds": round(waited, 1)}}) + "\n"
+
+    @property
+    def queued(self) -> int:
+        return sum(len(tickets) for queue in self._queues.values() for tickets in queue.values())
+
+    def stats(self) -> dict:
+        return {
+            p: {
+                "running": self._running[p],
+                "queued": self._queued_in(p),
+                "tenants_waiting": len(self._queues[p]),
+                "avg_service_seconds": round(self._service_seconds[p], 1),
+            }
+            for p in PRIORITIES
+        }
+
+    # -- internals --------------------------------------------------------
+
+    def _can_start(self, priority: str) -> bool:
+        if sum(self._running.values()) >= self.max_concurrent:
+            return False
+        return priority != BULK or self._running[BULK] < self.max_bulk_concurrent
+
+    def _waiting_ahead(self, priority: str) -> bool:
+        """Whether any queued request would be dispatched before a new ``priority`` one."""
+        for p in PRIORITIES:
+            if self._queues[p]:
+                return True
+            if p == priority:
+                return False
+        return False
+
+    def _queued_for_tenant(self, tenant: str) -> int:
+        return sum(len(queue.get(tenant, ())) for queue in self._queues.values())
+
+    def _grant(self, ticket: Ticket) -> None:
+        self._running[ticket.priority] += 1
+        ticket.started_at = time.monotonic()
+        ticket.granted.set_result(None)
+
+    def _dispatch(self) -> None:
+        """Admits queued tickets while slots are free, highest class first."""
+        while True:
+            for p in PRIORITIES:
+                if self._queues[p]:
+                    if self._can_start(p):
+                        self._grant(_pop_round_robin(self._queues[p]))
+                        break
+                    if p == INTERACTIVE:
+                        # No free slot at all; bulk cannot start either.
+                        return
+            else:
+                return
+
+    def _dispatch_order(self) -> List[Ticket]:
+        """The order queued tickets would be admitted in if nothing else arrived."""
+        order = []
+        for p in PRIORITIES:
+            queue = OrderedDict((tenant, deque(tickets)) for tenant, tickets in self._queues[p].items())
+            while queue:
+                order.append(_pop_round_robin(queue))
+        return order
+
+    def _queued_in(self, priority: str) -> int:
+        return sum(len(tickets) for tickets in self._queues[priority].values())
+
+    def _wait_for(self, priority: str, interactive_ahead: int, bulk_ahead: int) -> float:
+        """Rough seconds until a ``priority`` request with the given queue ahead is admitted.
+
+        Interactive requests drain through every slot; bulk requests only start once
+        no interactive request is waiting, and then through the bulk slots alone.
+        """
+        interactive_seconds = self._service_seconds[INTERACTIVE]
+        if priority == INTERACTIVE:
+            return (interactive_ahead // self.max_concurrent + 1) * interactive_seconds
+        wait = math.ceil(interactive_ahead / self.max_concurrent) * interactive_seconds
+        return wait + (bulk_ahead // self.max_bulk_concurrent + 1) * self._service_seconds[BULK]
+
+    def _retry_after(self, priority: str) -> int:
+        """Seconds until a new ``priority`` request would get a slot behind the current queue."""
+        interactive_ahead = self._queued_in(INTERACTIVE)
+        bulk_ahead = self._queued_in(BULK) if priority == BULK else 0
+        return max(1, math.ceil(self._wait_for(priority, interactive_ahead, bulk_ahead)))
+
+
+admission = AdmissionController()
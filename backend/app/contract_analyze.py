@@ -2,13 +2,20 @@ import json
 import os
 import logging
 import asyncio
-from typing import Dict
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Tuple
 
 from google import genai
 from PyPDF2 import PdfReader
 from openpyxl import Workbook, load_workbook
 from datetime import datetime
 
+from app.executors import get_executor, run_cpu, run_disk, run_model, run_text
+from app.sessions import AnalysisSession, SessionStore
+from schemas.contracts import ContractDocument
+
 # Configure logging
 # These logs will be useful for a future UI-based developer log window
 logging.basicConfig(level=logging.INFO)
@@ -46,6 +53,22 @@ MOCK_ANALYSIS_RESULT = {
     ]
 }
 
+# Stand-in contract pages for Test Mode sessions, matching the mock findings above.
+MOCK_CONTRACT_PAGES = [
+    "1.2 This Amendment shall become effective on the Effective Date.\n",
+    "",
+    "",
+    "5.3 Interest shall accrue daily as Principal * Rate / 360.\n",
+    "",
+    "",
+    "8.1 This Amendment shall be governed by the laws of the State of [__].\n",
+]
+
+MOCK_FOLLOW_UP_ANSWER = (
+    "The 360-day basis appears only in Section 5.3 on Page 4 "
+    "(\"Principal * Rate / 360\"). No other section of the contract uses it."
+)
+
 def _get_client():
     """Returns a Gemini Client using API keys from environment variables."""
     api_key = os.getenv("GEMINI_API_KEY")
@@ -85,6 +108,20 @@ Return ONLY a valid JSON object with the following structure:
 If no errors are found, return {"errors": []}.
 """
 
+# Instructions for follow-up questions on an already audited contract.
+FOLLOW_UP_PROMPT = """
+Role: You are a precise Legal Proofreader answering a lawyer's follow-up questions about a contract you have already audited.
+Input: The full contract text (with page markers) and the JSON findings of your audit.
+
+INSTRUCTIONS:
+1. Answer ONLY from the contract text. If the answer is not in the text, say so.
+2. Cite page and section for every statement, and quote the exact text where helpful.
+3. Be concise. Plain text, no JSON.
+"""
+
+# Number of previous question/answer turns included with each follow-up.
+FOLLOW_UP_HISTORY_TURNS = 5
+
 def _yield_log(level: str, message: str):
     """Utility to yield log objects in a format the frontend expects."""
     from datetime import datetime
@@ -96,8 +133,40 @@ def _yield_log(level: str, message: str):
         }
     }) + "\n"
 
+# Serializes workbook read-modify-write cycles across disk executor threads.
+_excel_lock = threading.Lock()
+
+def _extract_pages(file_path: str) -> List[str]:
+    """Extracts the text of every PDF page."""
+    with open(file_path, "rb") as f:
+        reader = PdfReader(f)
+        return [page.extract_text() or "" for page in reader.pages]
+
+def _analysis_prompt(document: ContractDocument) -> str:
+    """The audit prompt with the page-marked contract text. Linear in the document; run on the text executor."""
+    return f"{TEST_PROMPT}\n\n--- CONTRACT TEXT BEGINS ---\n{document.to_prompt_text()}\n--- CONTRACT TEXT ENDS ---"
+
+def _locate_quotes(document: ContractDocument, errors: List[dict]) -> List[dict]:
+    """Adds the 1-based ``page`` of each finding's ``exact_quote`` when it is found in the document."""
+    for error in errors:
+        quote = error.get("exact_quote") if isinstance(error, dict) else None
+        if not isinstance(quote, str) or not quote or "page" in error:
+            continue
+        offset = document.find(quote)
+        if offset >= 0:
+            error["page"] = document.page_of(offset) + 1
+    return errors
+
+def _extract_document(file_path: str, name: str) -> Tuple[ContractDocument, List[int]]:
+    """Extracts and indexes a PDF, returning the document and per-page character counts.
+
+    CPU-bound; runs in the cpu process pool, so it must stay a picklable module-level function.
+    """
+    pages = _extract_pages(file_path)
+    return ContractDocument.from_pages(name, pages), [len(page) for page in pages]
+
 def _log_to_excel(model: str, prompt: str, output: str):
-    """Logs the analysis session to an Excel file."""
+    """Logs the analysis session to an Excel file. Blocking; run on the disk executor."""
     file_path = "audit_logs.xlsx"
     headers = ["Timestamp", "Model", "Prompt Snippet", "Full Prompt", "Output"]
     
@@ -105,30 +174,40 @@ def _log_to_excel(model: str, prompt: str, output: str):
     prompt_snippet = (prompt[:100] + "...") if len(prompt) > 100 else prompt
 
     try:
-        if os.path.exists(file_path):
-            wb = load_workbook(file_path)
-            ws = wb.active
-        else:
-            wb = Workbook()
-            ws = wb.active
-            ws.append(headers)
-
-        ws.append([
-            datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            model,
-            prompt_snippet,
-            prompt,
-            output
-        ])
-        wb.save(file_path)
-        logger.info(f"Audit log saved to {file_path}")
+        with _excel_lock:
+            if os.path.exists(file_path):
+                wb = load_workbook(file_path)
+                ws = wb.active
+            else:
+                wb = Workbook()
+                ws = wb.active
+                ws.append(headers)
+
+            ws.append([
+                datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                model,
+                prompt_snippet,
+                prompt,
+                output
+            ])
+            wb.save(file_path)
+            logger.info(f"Audit log saved to {file_path}")
     except Exception as e:
         logger.error(f"Failed to save audit log to Excel: {e}")
 
 
-async def analyze_document_generator(file_path: str, test_mode: bool = False):
+async def analyze_document_generator(
+    file_path: str,
+    test_mode: bool = False,
+    file_name: Optional[str] = None,
+    keep_session: bool = True,
+):
     """
     Async Generator that analyzes a PDF and yields status updates and logs.
+
+    When ``keep_session`` is set, the extracted text and findings are kept in a
+    follow-up session (see ``ask_session_generator``) and a final ``session``
+    event carrying its id is yielded after the result.
     """
     filename = os.path.basename(file_path)
     logger.info(f"Starting analysis for: {filename} (Test Mode: {test_mode})")
@@ -157,63 +236,70 @@ async def analyze_document_generator(file_path: str, test_mode: bool = False):
         await asyncio.sleep(0.5)
         yield _yield_log("INFO", "Analysis successfully completed.")
         yield json.dumps({"result": MOCK_ANALYSIS_RESULT}) + "\n"
+        if keep_session:
+            document = ContractDocument.from_pages(file_name or filename, MOCK_CONTRACT_PAGES)
+            async for line in _open_session(None, document, MOCK_ANALYSIS_RESULT, test_mode=True):
+                yield line
         return
 
     try:
         yield _yield_log("INFO", "Initializing Gemini 2.0 Flash client...")
         client = _get_client()
         
+        yield _yield_log("DEBUG", f"Opening file stream: {file_path}")
         try:
-            yield _yield_log("DEBUG", f"Opening file stream: {file_path}")
-            with open(file_path, "rb") as f:
-                try:
-                    reader = PdfReader(f)
-                    text = ""
-                    page_count = len(reader.pages)
-                    yield _yield_log("INFO", f"PDF loaded. Total pages discovered: {page_count}")
-                    
-                    for i, page in enumerate(reader.pages):
-                        extracted = page.extract_text() or ""
-                        # Insert a clear page marker so the AI handles cross-page text correctly
-                        text += f"\n\n--- [START OF PAGE {i+1}] ---\n"
-                        text += extracted
-                        yield _yield_log("DEBUG", f"Page {i+1} processed. ({len(extracted)} chars)")
-                except Exception as pdf_err:
-                     yield _yield_log("ERROR", f"PDF Read Error: {str(pdf_err)}")
-                     yield json.dumps({"result": {"errors": [{"location": "Document", "error": f"Corrupt or unreadable PDF: {str(pdf_err)}", "suggestion": "Try repairing the PDF or export it again."}]}}) + "\n"
-                     return
-        
-            if not text.strip():
-                 yield _yield_log("ERROR", "Extraction failed. PDF text layer is empty.")
-                 yield json.dumps({"result": {"errors": [{"location": "Document", "error": "Could not extract text from PDF.", "suggestion": "Ensure PDF is text-based, not scanned image."}]}}) + "\n"
-                 return
-        except Exception as e:
+            # PyPDF2 parsing is CPU-bound, so it runs in the dedicated cpu process pool.
+            document, page_chars = await run_cpu(_extract_document, file_path, file_name or filename)
+        except OSError as e:
             # Catch file access errors (though less likely with tempfile)
             yield _yield_log("ERROR", f"File Access Error: {str(e)}")
             raise e
+        except BrokenProcessPool:
+            # A parser worker died (crash or out of memory). It may have been this PDF or
+            # another one sharing the pool; the pool is rebuilt for the next request.
+            yield _yield_log("ERROR", "PDF parser process crashed during extraction.")
+            yield json.dumps({"result": {"errors": [{"location": "System", "error": "The PDF parser crashed while reading this document.", "suggestion": "Retry the analysis. If it fails again, the PDF may be malformed or too large to parse."}]}}) + "\n"
+            return
+        except Exception as pdf_err:
+            yield _yield_log("ERROR", f"PDF Read Error: {str(pdf_err)}")
+            yield json.dumps({"result": {"errors": [{"location": "Document", "error": f"Corrupt or unreadable PDF: {str(pdf_err)}", "suggestion": "Try repairing the PDF or export it again."}]}}) + "\n"
+            return
+
+        yield _yield_log("INFO", f"PDF loaded. Total pages discovered: {len(page_chars)}")
+        for i, chars in enumerate(page_chars):
+            yield _yield_log("DEBUG", f"Page {i+1} processed. ({chars} chars)")
+        # One contiguous buffer with page/section offsets; later steps slice it instead of rescanning.
+        yield _yield_log("DEBUG", f"Indexed {document.page_count} pages and {document.section_count} sections.")
+
+        if document.is_blank():
+            yield _yield_log("ERROR", "Extraction failed. PDF text layer is empty.")
+            yield json.dumps({"result": {"errors": [{"location": "Document", "error": "Could not extract text from PDF.", "suggestion": "Ensure PDF is text-based, not scanned image."}]}}) + "\n"
+            return
 
-        yield _yield_log("INFO", f"Extraction successful. Total content: {len(text)} characters.")
+        yield _yield_log("INFO", f"Extraction successful. Total content: {len(document)} bytes.")
         
         yield json.dumps({"stage": "distributing", "message": "Topic Distributor: Parsing sections and routing tasks..."}) + "\n"
         yield _yield_log("INFO", "Analyzing contract metadata and structure...")
         
+        # The flat prompt string exists only while it is being sent and logged.
+        full_prompt = await run_text(_analysis_prompt, document)
         yield json.dumps({"stage": "analyzing", "message": "Legal Reviewer: Critiquing contract clauses with Gemini..."}) + "\n"
-        yield _yield_log("INFO", f"Sending context window of {len(text)} tokens to Gemini API...")
+        yield _yield_log("INFO", f"Sending context window of {len(full_prompt)} tokens to Gemini API...")
         
-        # Run sync API call in threadpool to avoid blocking event loop
-        loop = asyncio.get_running_loop()
-        response = await loop.run_in_executor(None, lambda: client.models.generate_content(
+        # Run sync API call on the model executor to avoid blocking event loop
+        response = await run_model(
+            client.models.generate_content,
             model=MODEL_NAME,
-            contents=f"{TEST_PROMPT}\n\n--- CONTRACT TEXT BEGINS ---\n{text}\n--- CONTRACT TEXT ENDS ---",
+            contents=full_prompt,
             config={"response_mime_type": "application/json"}
-        ))
+        )
         
         raw_output = response.text
         yield _yield_log("INFO", "Analysis received from Gemini.")
         
         # Log to Excel (Non-test mode only)
-        full_prompt = f"{TEST_PROMPT}\n\n--- CONTRACT TEXT BEGINS ---\n{text}\n--- CONTRACT TEXT ENDS ---"
-        _log_to_excel(MODEL_NAME, full_prompt, raw_output)
+        await run_disk(_log_to_excel, MODEL_NAME, full_prompt, raw_output)
+        del full_prompt
         
         yield _yield_log("DEBUG", f"Raw AI Output snippet: {raw_output[:100]}...")
 
@@ -225,11 +311,13 @@ async def analyze_document_generator(file_path: str, test_mode: bool = False):
             
             if isinstance(data, list):
                 yield _yield_log("WARNING", "AI returned list without wrapper. Normalizing...")
-                yield json.dumps({"result": {"errors": data}}) + "\n"
-                return
-            
-            error_count = len(data.get("errors", []))
-            yield _yield_log("INFO", f"Pipeline finished. Found {error_count} potential issues.")
+                data = {"errors": data}
+            else:
+                error_count = len(data.get("errors", []))
+                yield _yield_log("INFO", f"Pipeline finished. Found {error_count} potential issues.")
+            if isinstance(data.get("errors"), list) and data["errors"]:
+                yield _yield_log("DEBUG", "Locating quoted text in the document...")
+                data["errors"] = await run_text(_locate_quotes, document, data["errors"])
             yield json.dumps({"result": data}) + "\n"
             
         except json.JSONDecodeError as jde:
@@ -241,6 +329,11 @@ async def analyze_document_generator(file_path: str, test_mode: bool = False):
                     "suggestion": "Check logs for raw output or retry analysis."
                 }]
             }}) + "\n"
+            return
+
+        if keep_session:
+            async for line in _open_session(client, document, data):
+                yield line
 
     except Exception as e:
         yield _yield_log("CRITICAL", f"Analysis pipeline crashed: {str(e)}")
@@ -254,10 +347,222 @@ async def analyze_document_generator(file_path: str, test_mode: bool = False):
 
 async def analyze_document(file_path: str, test_mode: bool = False) -> Dict:
     """Wrapper for async generator (for non-streaming use cases)."""
-    gen = analyze_document_generator(file_path, test_mode)
+    gen = analyze_document_generator(file_path, test_mode, keep_session=False)
     last_res = {}
     async for item in gen:
         data = json.loads(item)
         if "result" in data:
             last_res = data["result"]
     return last_res
+
+
+def _release_context_cache(session: AnalysisSession):
+    """Eviction hook: deletes the provider-side cached context of a session."""
+    if not session.cache_name:
+        return
+    # Fire-and-forget on the model executor, which keeps the job alive until it completes.
+    get_executor("model").submit(_delete_context_cache, session.cache_name)
+
+
+def _delete_context_cache(cache_name: str):
+    try:
+        _get_client().caches.delete(name=cache_name)
+        logger.info(f"Deleted cached context {cache_name}")
+    except Exception as e:
+        logger.warning(f"Failed to delete cached context {cache_name}: {e}")
+
+
+# Analyzed documents kept for follow-up questions.
+session_store = SessionStore(on_evict=_release_context_cache)
+
+
+def _session_context(document: ContractDocument, findings: dict) -> str:
+    """The document context shared by every follow-up question of a session.
+
+    Decodes the whole document, so call it off the event loop.
+    """
+    return (
+        f"--- CONTRACT TEXT BEGINS ---\n{document.to_prompt_text()}\n--- CONTRACT TEXT ENDS ---\n\n"
+        f"--- AUDIT FINDINGS ---\n{json.dumps(findings, indent=2)}"
+    )
+
+
+def _question_prompt(session: AnalysisSession, question: str) -> str:
+    """Recent follow-up history plus the new question."""
+    parts = []
+    for turn in session.history[-FOLLOW_UP_HISTORY_TURNS:]:
+        parts.append(f"Q: {turn['question']}\nA: {turn['answer']}")
+    parts.append(f"Q: {question}\nA:")
+    return "\n\n".join(parts)
+
+
+def _create_context_cache(client, session: AnalysisSession) -> str:
+    """Registers the session document as cached context with Gemini. Blocking."""
+    cache = client.caches.create(
+        model=MODEL_NAME,
+        config={
+            "display_name": f"legal-audit-{session.id}",
+            "system_instruction": FOLLOW_UP_PROMPT,
+            "contents": [_session_context(session.document, session.findings)],
+            "ttl": f"{int(session_store.ttl_seconds)}s",
+        },
+    )
+    session.cache_expires_at = time.monotonic() + session_store.ttl_seconds
+    return cache.name
+
+
+def _extend_context_cache(client, session: AnalysisSession):
+    """Pushes the provider cache expiry out by a full session TTL. Blocking."""
+    client.caches.update(
+        name=session.cache_name,
+        config={"ttl": f"{int(session_store.ttl_seconds)}s"},
+    )
+    session.cache_expires_at = time.monotonic() + session_store.ttl_seconds
+
+
+async def _refresh_context_cache(client, session: AnalysisSession, failed_cache: Optional[str] = None) -> List[str]:
+    """Keeps an active session's provider cache alive, re-creating it if it is gone.
+
+    The session TTL is an idle timeout, while the provider cache expires a fixed
+    time after creation; the cache is extended once half its lifetime has passed.
+    ``failed_cache`` is a cache name a request just failed with: it is re-created
+    unless a concurrent request already replaced it. Refreshes are serialized per
+    session, every replaced cache is deleted, and no cache is kept for a session
+    that has left the store. Returns log lines. On failure the session falls back
+    to local context.
+    """
+    logs = []
+    async with session.cache_lock:
+        if not session.cache_name or (failed_cache is not None and session.cache_name != failed_cache):
+            return logs
+        if failed_cache is None:
+            remaining = (session.cache_expires_at or 0) - time.monotonic()
+            if remaining > session_store.ttl_seconds / 2:
+                return logs
+            try:
+                await run_model(_extend_context_cache, client, session)
+                logs.append(_yield_log("DEBUG", f"Extended cached context {session.cache_name}"))
+                return logs
+            except Exception as e:
+                logs.append(_yield_log("WARNING", f"Could not extend cached context, re-creating it: {str(e)}"))
+        if session not in session_store:
+            # Evicted; eviction already released its cache.
+            session.cache_name = None
+            return logs
+
+        old_cache_name = session.cache_name
+        try:
+            new_cache_name = await run_model(_create_context_cache, client, session)
+        except Exception as e:
+            new_cache_name = None
+            logs.append(_yield_log("WARNING", f"Context caching unavailable, using local context: {str(e)}"))
+        if session not in session_store:
+            # Evicted while the cache was being created: eviction released the old cache
+            # but could not see the new one.
+            if new_cache_name:
+                get_executor("model").submit(_delete_context_cache, new_cache_name)
+            session.cache_name = None
+            return logs
+        session.cache_name = new_cache_name
+        if new_cache_name:
+            logs.append(_yield_log("INFO", f"Context cache re-created: {new_cache_name}"))
+        get_executor("model").submit(_delete_context_cache, old_cache_name)
+    return logs
+
+
+async def _open_session(client, document: ContractDocument, findings: dict, test_mode: bool = False):
+    """Stores an analyzed document for follow-up questions and yields its session event."""
+    session = AnalysisSession(document=document, findings=findings, test_mode=test_mode)
+
+    if not test_mode:
+        try:
+            yield _yield_log("DEBUG", "Registering contract as cached context for follow-up questions...")
+            session.cache_name = await run_model(_create_context_cache, client, session)
+            yield _yield_log("INFO", f"Context cache created: {session.cache_name}")
+        except Exception as e:
+            # Too small to cache, unsupported model, quota... fall back to the stored text.
+            yield _yield_log("WARNING", f"Context caching unavailable, using local context: {str(e)}")
+
+    if not session_store.add(session):
+        _release_context_cache(session)
+        yield _yield_log("WARNING", "Document too large to keep for follow-up questions.")
+        return
+
+    yield json.dumps({"session": {
+        "id": session.id,
+        "cached": session.cache_name is not None,
+        "expires_in": round(session_store.expires_in(session)),
+    }}) + "\n"
+
+
+async def _stream_answer(client, session: AnalysisSession, question: str):
+    """Yields answer text chunks from Gemini, using cached context when available."""
+    if session.cache_name:
+        contents = _question_prompt(session, question)
+        config = {"cached_content": session.cache_name}
+    else:
+        context = await run_text(_session_context, session.document, session.findings)
+        contents = f"{FOLLOW_UP_PROMPT}\n\n{context}\n\n{_question_prompt(session, question)}"
+        config = None
+
+    # The SDK stream is synchronous, so every chunk is pulled on the model executor.
+    stream = await run_model(
+        client.models.generate_content_stream,
+        model=MODEL_NAME,
+        contents=contents,
+        config=config,
+    )
+    while True:
+        chunk = await run_model(next, stream, None)
+        if chunk is None:
+            break
+        if chunk.text:
+            yield chunk.text
+
+
+async def ask_session_generator(session: AnalysisSession, question: str):
+    """
+    Async Generator that answers a follow-up question about an analyzed contract.
+    Yields logs, ``answer_chunk`` events while streaming and a final ``answer``.
+    """
+    yield _yield_log("INFO", f"Follow-up question on {session.file_name} (session {session.id})")
+    answer = ""
+
+    try:
+        if session.test_mode:
+            yield _yield_log("INFO", "Test Mode is enabled. Streaming mock answer.")
+            for word in MOCK_FOLLOW_UP_ANSWER.split(" "):
+                await asyncio.sleep(0.02)
+                piece = word if not answer else f" {word}"
+                answer += piece
+                yield json.dumps({"answer_chunk": piece}) + "\n"
+        else:
+            client = _get_client()
+            for line in await _refresh_context_cache(client, session):
+                yield line
+            if session.cache_name:
+                yield _yield_log("DEBUG", f"Using cached context {session.cache_name}")
+            else:
+                yield _yield_log("DEBUG", f"Sending stored context of {len(session.document)} bytes")
+            cache_name = session.cache_name
+            try:
+                async for piece in _stream_answer(client, session, question):
+                    answer += piece
+                    yield json.dumps({"answer_chunk": piece}) + "\n"
+            except Exception as e:
+                if not cache_name or answer:
+                    raise
+                # The provider cache may have expired before the session did.
+                yield _yield_log("WARNING", f"Cached context failed: {str(e)}")
+                for line in await _refresh_context_cache(client, session, failed_cache=cache_name):
+                    yield line
+                async for piece in _stream_answer(client, session, question):
+                    answer += piece
+                    yield json.dumps({"answer_chunk": piece}) + "\n"
+    except Exception as e:
+        yield _yield_log("CRITICAL", f"Follow-up question failed: {str(e)}")
+        yield json.dumps({"answer": {"question": question, "text": answer, "error": str(e)}}) + "\n"
+        return
+
+    session_store.add_turn(session, question, answer)
+    yield json.dumps({"answer": {"question": question, "text": answer}}) + "\n"
@@ -0,0 +1,147 @@
+"""Dedicated executors for blocking work that must stay off the event loop.
+
+Each kind of blocking work gets its own pool so that one slow class of work
+(e.g. a long model call) cannot starve another (e.g. PDF parsing):
+
+* ``cpu``   - CPU-bound parsing such as PyPDF2 text extraction. This is a
+  process pool: pure-Python parsing holds the GIL, so threads would give no
+  parallelism and would stall the event loop thread. Functions and results
+  sent to it must be picklable. If a worker dies (e.g. a segfault or OOM on a
+  malformed PDF) the pool is broken for good; it is discarded and rebuilt on
+  the next call.
+* ``text``  - in-process work on already extracted text (building prompts,
+  searching quotes). Threads, not processes: shipping a whole document to a
+  worker process and back costs more than the linear pass itself.
+* ``disk``  - local file I/O (temp uploads, Excel audit log, README appends).
+* ``model`` - synchronous network calls to the Gemini SDK.
+* ``proc``  - ``subprocess`` calls (git).
+
+Pool sizes can be tuned with ``EXECUTOR_<KIND>_WORKERS`` environment variables.
+"""
+import asyncio
+import functools
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Default worker counts per executor kind.
+DEFAULT_WORKERS = {
+    "cpu": max(1, (os.cpu_count() or 1)),
+    "text": 2,
+    "disk": 4,
+    "model": 16,
+    "proc": 2,
+}
+
+_executors: Dict[str, Executor] = {}
+_lock = threading.Lock()
+
+
+def _workers_for(kind: str) -> int:
+    """Returns the configured worker count for an executor kind."""
+    value = os.getenv(f"EXECUTOR_{kind.upper()}_WORKERS")
+    if value:
+        try:
+            return max(1, int(value))
+        except ValueError:
+            logger.warning(f"Ignoring invalid EXECUTOR_{kind.upper()}_WORKERS={value!r}")
+    return DEFAULT_WORKERS[kind]
+
+
+def get_executor(kind: str) -> Executor:
+    """Returns (creating lazily) the executor dedicated to ``kind``."""
+    if kind not in DEFAULT_WORKERS:
+        raise ValueError(f"Unknown executor kind: {kind}")
+    with _lock:
+        executor = _executors.get(kind)
+        if executor is None:
+            if kind == "cpu":
+                # spawn, not fork: the server process already runs executor and watchdog threads.
+                executor = ProcessPoolExecutor(
+                    max_workers=_workers_for(kind),
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            else:
+                executor = ThreadPoolExecutor(
+                    max_workers=_workers_for(kind),
+                    thread_name_prefix=f"legal-audit-{kind}",
+                )
+            _executors[kind] = executor
+        return executor
+
+
+def _discard_executor(kind: str, executor: Executor) -> None:
+    """Drops a broken executor so the next ``get_executor`` call builds a new one."""
+    with _lock:
+        if _executors.get(kind) is not executor:
+            # Another caller already replaced it.
+            return
+        del _executors[kind]
+    logger.warning(f"The {kind} executor is broken (a worker process died); it will be recreated.")
+    executor.shutdown(wait=False)
+
+
+async def run_in(kind: str, func: Callable[..., T], *args, **kwargs) -> T:
+    """Runs ``func(*args, **kwargs)`` on the ``kind`` executor and awaits the result.
+
+    Raises ``BrokenProcessPool`` if a worker died while running the call (or any
+    call sharing the pool); the pool is then replaced for subsequent calls. The
+    call itself is not retried, since it may be what killed the worker.
+    """
+    loop = asyncio.get_running_loop()
+    call = functools.partial(func, *args, **kwargs)
+    executor = get_executor(kind)
+    try:
+        return await loop.run_in_executor(executor, call)
+    except BrokenProcessPool:
+        _discard_executor(kind, executor)
+        raise
+
+
+async def run_cpu(func: Callable[..., T], *args, **kwargs) -> T:
+    return await run_in("cpu", func, *args, **kwargs)
+
+
+async def run_text(func: Callable[..., T], *args, **kwargs) -> T:
+    return await run_in("text", func, *args, **kwargs)
+
+
+async def run_disk(func: Callable[..., T], *args, **kwargs) -> T:
+    return await run_in("disk", func, *args, **kwargs)
+
+
+async def run_model(func: Callable[..., T], *args, **kwargs) -> T:
+    return await run_in("model", func, *args, **kwargs)
+
+
+async def run_proc(func: Callable[..., T], *args, **kwargs) -> T:
+    return await run_in("proc", func, *args, **kwargs)
+
+
+def executor_stats() -> Dict[str, dict]:
+    """Returns the configured size of every executor kind and whether it is running."""
+    with _lock:
+        return {
+            kind: {
+                "max_workers": _executors[kind]._max_workers if kind in _executors else _workers_for(kind),
+                "started": kind in _executors,
+            }
+            for kind in DEFAULT_WORKERS
+        }
+
+
+def shutdown_executors(wait: bool = True) -> None:
+    """Shuts down all executors. They are recreated on next use."""
+    with _lock:
+        executors = list(_executors.values())
+        _executors.clear()
+    for executor in executors:
+        executor.shutdown(wait=wait)
@@ -0,0 +1,130 @@
+"""Event-loop lag watchdog.
+
+A sampler task sleeps for a fixed interval and records how late it wakes up
+(the scheduling delay every other coroutine on the loop also experiences).
+A separate watchdog thread watches the sampler's heartbeat; when the loop has
+not ticked for longer than the threshold it logs the stack of whatever is
+currently running on the loop thread, i.e. the blocking callback.
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Deque, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Defaults can be overridden via environment variables (milliseconds).
+DEFAULT_INTERVAL_MS = float(os.getenv("LOOP_LAG_INTERVAL_MS", "100"))
+DEFAULT_THRESHOLD_MS = float(os.getenv("LOOP_LAG_THRESHOLD_MS", "250"))
+DEFAULT_WINDOW = int(os.getenv("LOOP_LAG_WINDOW", "1200"))
+
+
+def _percentile(sorted_values, pct: float) -> float:
+    """Nearest-rank percentile of an already sorted sequence."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class LoopLagMonitor:
+    """Samples event-loop scheduling delay and reports blocking callbacks."""
+
+    def __init__(
+        self,
+        interval_ms: float = DEFAULT_INTERVAL_MS,
+        threshold_ms: float = DEFAULT_THRESHOLD_MS,
+        window: int = DEFAULT_WINDOW,
+    ):
+        self.interval = interval_ms / 1000.0
+        self.threshold = threshold_ms / 1000.0
+        self._samples: Deque[float] = deque(maxlen=window)
+        self._blocked_count = 0
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        """Starts sampling on the running loop. Must be called from the loop thread."""
+        if self.running:
+            return
+        loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._task = loop.create_task(self._sample())
+        self._watchdog = threading.Thread(
+            target=self._watch, name="loop-lag-watchdog", daemon=True
+        )
+        self._watchdog.start()
+        logger.info(
+            f"Loop lag monitor started (interval={self.interval * 1000:.0f}ms, "
+            f"threshold={self.threshold * 1000:.0f}ms)"
+        )
+
+    async def stop(self) -> None:
+        """Stops the sampler task and the watchdog thread."""
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._watchdog is not None:
+            self._watchdog.join(timeout=1)
+            self._watchdog = None
+
+    async def _sample(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - start - self.interval)
+            self._samples.append(lag)
+            self._heartbeat = time.monotonic()
+            if lag > self.threshold:
+                logger.warning(f"Event loop lag of {lag * 1000:.1f}ms detected")
+
+    def _watch(self) -> None:
+        reported_for = None
+        while not self._stop.wait(self.interval):
+            heartbeat = self._heartbeat
+            stalled = time.monotonic() - heartbeat - self.interval
+            if stalled <= self.threshold or reported_for == heartbeat:
+                continue
+            # Report each stall once, with the stack of the blocking code.
+            reported_for = heartbeat
+            self._blocked_count += 1
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "<unavailable>"
+            logger.warning(
+                f"Event loop blocked for {stalled * 1000:.0f}ms. Blocking stack:\n{stack}"
+            )
+
+    def stats(self) -> Dict[str, float]:
+        """Returns lag percentiles (milliseconds) over the sample window."""
+        values = sorted(self._samples)
+        return {
+            "samples": len(values),
+            "blocked_events": self._blocked_count,
+            "p50_ms": round(_percentile(values, 50) * 1000, 3),
+            "p90_ms": round(_percentile(values, 90) * 1000, 3),
+            "p99_ms": round(_percentile(values, 99) * 1000, 3),
+            "max_ms": round((values[-1] if values else 0.0) * 1000, 3),
+        }
+
+
+monitor = LoopLagMonitor()
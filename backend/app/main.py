@@ -1,17 +1,31 @@
 """Main entry point for the legal audit agent."""
+import hmac
 import logging
 import os
+import re
 import shutil
 import tempfile
 import uuid
-from typing import List
+from contextlib import asynccontextmanager
+from typing import List, Optional
 
-from fastapi import FastAPI, File, HTTPException, UploadFile, status
+from fastapi import FastAPI, File, HTTPException, Request, UploadFile, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from starlette.background import BackgroundTask
 
-from app.contract_analyze import analyze_document, analyze_document_generator, _get_client
+from app.admission import BULK, INTERACTIVE, PRIORITIES, QueueFullError, admission
+
+from app.contract_analyze import (
+    analyze_document,
+    analyze_document_generator,
+    ask_session_generator,
+    session_store,
+    _get_client,
+)
+from app.executors import executor_stats, run_disk, run_model, run_proc, shutdown_executors
+from app.loop_monitor import monitor
 import subprocess
 import json
 from datetime import datetime
@@ -24,7 +38,141 @@ class AnalyzeResponse(BaseModel):
     errors: List[dict]
 
 
-app = FastAPI()
+# Uploads with more pages than this, or larger than BULK_UPLOAD_BYTES, are scheduled as bulk work.
+BULK_PAGE_COUNT = int(os.getenv("BULK_PAGE_COUNT", "50"))
+BULK_UPLOAD_BYTES = int(os.getenv("BULK_UPLOAD_BYTES", str(5 * 1024 * 1024)))
+# Tenant API keys as "key:tenant" pairs (comma-separated). Clients authenticate with an X-API-Key header;
+# requests without a valid key are queued per client address.
+TENANT_API_KEYS = {
+    key.strip(): tenant.strip()
+    for key, _, tenant in (pair.partition(":") for pair in os.getenv("TENANT_API_KEYS", "").split(","))
+    if key.strip() and tenant.strip()
+}
+# Authenticated tenants allowed to run bulk-sized uploads as interactive with ?priority=interactive (comma-separated).
+PRIORITY_OVERRIDE_TENANTS = {
+    tenant.strip() for tenant in os.getenv("PRIORITY_OVERRIDE_TENANTS", "").split(",") if tenant.strip()
+}
+
+
+def _tenant_of(request: Request) -> str:
+    """The tenant a request is queued and limited as.
+
+    Only server-checked identities are used: the tenant of a valid ``X-API-Key``,
+    otherwise the client address (prefixed so it can never match a configured tenant name).
+    """
+    api_key = request.headers.get("X-API-Key")
+    if api_key:
+        for key, tenant in TENANT_API_KEYS.items():
+            if hmac.compare_digest(api_key.encode(), key.encode()):
+                return tenant
+    return f"client:{request.client.host if request.client else 'anonymous'}"
+
+
+# Page objects ("/Type /Page", not "/Pages") in the uncompressed part of a PDF.
+_PAGE_OBJECT = re.compile(rb"/Type\s*/Page(?![A-Za-z])")
+
+
+def _classify_upload(contents: bytes) -> str:
+    """Server-side priority class of an upload, from its size and a rough page count.
+
+    Runs before admission, so it must stay cheap: pages are counted by scanning the
+    raw bytes (at most BULK_UPLOAD_BYTES, a few milliseconds) instead of parsing the
+    PDF. Pages stored in compressed object streams are not seen, so such uploads
+    are classified by size alone.
+    """
+    if len(contents) > BULK_UPLOAD_BYTES:
+        return BULK
+    page_count = sum(1 for _ in _PAGE_OBJECT.finditer(contents))
+    return BULK if page_count > BULK_PAGE_COUNT else INTERACTIVE
+
+
+def _resolve_priority(tenant: str, requested: Optional[str], classified: str) -> str:
+    """Clients may lower their priority; raising bulk work to interactive needs an allowlisted, authenticated tenant."""
+    if requested is None or requested == classified or requested == BULK:
+        return requested or classified
+    if tenant in PRIORITY_OVERRIDE_TENANTS:
+        return INTERACTIVE
+    logger.info(f"Ignoring priority=interactive for bulk-sized upload from tenant {tenant}")
+    return BULK
+
+
+def _shed_error(tenant: str, priority: str, exc: QueueFullError) -> HTTPException:
+    """The 429 response for a request the admission queue cannot take."""
+    logger.warning(f"Shedding {priority} request for tenant {tenant}: {exc}")
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail=str(exc),
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+def _admit(tenant: str, priority: str):
+    """Takes an admission ticket, or rejects the request with 429."""
+    try:
+        return admission.submit(tenant, priority)
+    except QueueFullError as exc:
+        raise _shed_error(tenant, priority, exc) from exc
+
+
+async def _accept_upload(request: Request, file: UploadFile, priority: Optional[str]):
+    """Validates, classifies and admits an uploaded PDF, then stores it.
+
+    Returns ``(ticket, temp_dir, temp_path)``. Raises 400 for invalid uploads and
+    429 when the queue is saturated. Requests that would be shed are rejected
+    before the upload is classified or written to disk.
+    """
+    if not file.filename:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="File is required.")
+
+    if not file.filename.lower().endswith(".pdf"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Only PDF files are supported.")
+
+    if priority is not None and priority not in PRIORITIES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"priority must be one of: {', '.join(PRIORITIES)}",
+        )
+
+    tenant = _tenant_of(request)
+    # Before classification a request is at best interactive, the class least likely to be shed.
+    best_case = BULK if priority == BULK else INTERACTIVE
+    try:
+        admission.check_capacity(tenant, best_case)
+    except QueueFullError as exc:
+        raise _shed_error(tenant, best_case, exc) from exc
+
+    contents = await file.read()
+    ticket = _admit(tenant, _resolve_priority(tenant, priority, _classify_upload(contents)))
+
+    temp_dir = tempfile.mkdtemp(prefix="legal-audit-")
+    _, ext = os.path.splitext(file.filename)
+    temp_path = os.path.join(temp_dir, f"{uuid.uuid4()}{ext or '.pdf'}")
+    try:
+        await run_disk(_write_bytes, temp_path, contents)
+    except BaseException:
+        admission.release(ticket)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
+    return ticket, temp_dir, temp_path
+
+
+def _write_bytes(path: str, contents: bytes):
+    """Writes an uploaded file to disk. Blocking; run on the disk executor."""
+    with open(path, "wb") as out_file:
+        out_file.write(contents)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    monitor.start()
+    try:
+        yield
+    finally:
+        await monitor.stop()
+        shutdown_executors(wait=False)
+
+
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     "http://localhost",
@@ -51,35 +199,109 @@ async def health_check():
     return {"status": "OK"}
 
 
-@app.post("/analyze-contract-stream/")
-async def analyze_contract_stream(file: UploadFile = File(...), test_mode: bool = False):
-    """Upload a PDF and run contract analysis with real-time status updates."""
-    if not file.filename:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="File is required.")
+@app.get("/api/loop-lag")
+async def loop_lag():
+    """Event-loop lag percentiles and executor sizing for this worker."""
+    return {"running": monitor.running, "lag": monitor.stats(), "executors": executor_stats()}
 
-    if not file.filename.lower().endswith(".pdf"):
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Only PDF files are supported.")
 
-    temp_dir = tempfile.mkdtemp(prefix="legal-audit-")
-    _, ext = os.path.splitext(file.filename)
-    temp_path = os.path.join(temp_dir, f"{uuid.uuid4()}{ext or '.pdf'}")
+@app.get("/api/admission")
+async def admission_stats():
+    """Running and queued analyses per priority class."""
+    return admission.stats()
+
+
+@app.post("/analyze-contract-stream/")
+async def analyze_contract_stream(
+    request: Request,
+    file: UploadFile = File(...),
+    test_mode: bool = False,
+    priority: Optional[str] = None,
+):
+    """Upload a PDF and run contract analysis with real-time status updates."""
+    ticket, temp_dir, temp_path = await _accept_upload(request, file, priority)
 
     async def event_generator():
         try:
-            contents = await file.read()
-            with open(temp_path, "wb") as out_file:
-                out_file.write(contents)
+            # Queue position updates until a slot is free
+            async for queue_event in admission.wait_events(ticket):
+                yield queue_event
 
             # analyze_document_generator yields JSON strings
-            async for stage_data in analyze_document_generator(temp_path, test_mode=test_mode):
+            async for stage_data in analyze_document_generator(temp_path, test_mode=test_mode, file_name=file.filename):
                 yield f"{stage_data}\n"
         except Exception as e:
             logger.exception("Streaming analysis failed")
             yield json.dumps({"result": {"errors": [{"location": "System", "error": str(e), "suggestion": "Check logs"}]}}) + "\n"
         finally:
+            admission.release(ticket)
             shutil.rmtree(temp_dir, ignore_errors=True)
 
-    return StreamingResponse(event_generator(), media_type="application/x-ndjson")
+    # The background task releases the slot even if the stream never starts.
+    return StreamingResponse(
+        event_generator(),
+        media_type="application/x-ndjson",
+        background=BackgroundTask(admission.release, ticket),
+    )
+
+
+class FollowUpRequest(BaseModel):
+    question: str
+
+
+def _get_session_or_404(session_id: str):
+    session = session_store.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Session not found or expired.")
+    return session
+
+
+@app.get("/api/sessions/{session_id}")
+async def get_session(session_id: str):
+    """Returns the findings and follow-up history of an analyzed contract."""
+    session = _get_session_or_404(session_id)
+    return {
+        "id": session.id,
+        "file_name": session.file_name,
+        "cached": session.cache_name is not None,
+        "expires_in": round(session_store.expires_in(session)),
+        "findings": session.findings,
+        "history": session.history,
+    }
+
+
+@app.post("/api/sessions/{session_id}/ask")
+async def ask_session(session_id: str, body: FollowUpRequest, request: Request):
+    """Streams the answer to a follow-up question without re-uploading the contract."""
+    question = body.question.strip()
+    if not question:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Question is required.")
+    session = _get_session_or_404(session_id)
+    # Follow-ups use the same model quota, so they are admitted like quick interactive checks.
+    ticket = _admit(_tenant_of(request), INTERACTIVE)
+
+    async def event_generator():
+        try:
+            async for queue_event in admission.wait_events(ticket):
+                yield queue_event
+            async for line in ask_session_generator(session, question):
+                yield line
+        finally:
+            admission.release(ticket)
+
+    return StreamingResponse(
+        event_generator(),
+        media_type="application/x-ndjson",
+        background=BackgroundTask(admission.release, ticket),
+    )
+
+
+@app.delete("/api/sessions/{session_id}")
+async def delete_session(session_id: str):
+    """Ends a follow-up session and releases its cached context."""
+    if not session_store.remove(session_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Session not found or expired.")
+    return {"status": "deleted"}
 
 
 class GitSyncResponse(BaseModel):
@@ -98,10 +320,10 @@ async def git_sync():
         project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
 
         # 1. Stage all changes first (including untracked files) - FROM PROJECT ROOT
-        subprocess.run(["git", "add", "."], cwd=project_root, check=True)
+        await run_proc(subprocess.run, ["git", "add", "."], cwd=project_root, check=True)
 
         # 2. Check if there are staged changes to commit
-        diff_proc = subprocess.run(["git", "diff", "--cached"], cwd=project_root, capture_output=True, text=True, check=True)
+        diff_proc = await run_proc(subprocess.run, ["git", "diff", "--cached"], cwd=project_root, capture_output=True, text=True, check=True)
         diff_text = diff_proc.stdout
 
         if not diff_text.strip():
@@ -121,7 +343,8 @@ async def git_sync():
         {diff_text[:5000]} 
         """
         
-        response = client.models.generate_content(
+        response = await run_model(
+            client.models.generate_content,
             model="gemini-3-flash-preview", 
             contents=prompt
         )
@@ -129,9 +352,9 @@ async def git_sync():
         
         # 3. Add, Commit, Push
         # Note: We already staged everything in step 1, but running add again doesn't hurt to be sure.
-        subprocess.run(["git", "add", "."], cwd=project_root, check=True)
-        subprocess.run(["git", "commit", "-m", commit_message], cwd=project_root, check=True)
-        subprocess.run(["git", "push", "origin", "dev"], cwd=project_root, check=True)
+        await run_proc(subprocess.run, ["git", "add", "."], cwd=project_root, check=True)
+        await run_proc(subprocess.run, ["git", "commit", "-m", commit_message], cwd=project_root, check=True)
+        await run_proc(subprocess.run, ["git", "push", "origin", "dev"], cwd=project_root, check=True)
         
         return {"status": "success", "message": f"Synced: {commit_message}"}
     except Exception as e:
@@ -139,6 +362,13 @@ async def git_sync():
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _append_readme(readme_path: str, structured_note: str):
+    """Appends an ADHD dump entry to README.md. Blocking; run on the disk executor."""
+    with open(readme_path, "a") as f:
+        f.write(f"\n\n### ADHD Dump Case Log ({datetime.now().strftime('%Y-%m-%d %H:%M')})\n")
+        f.write(f"{structured_note}\n")
+
+
 @app.post("/api/adhd-dump")
 async def adhd_dump(request: ADHDDumpRequest):
     """Summarizes a quick thought and appends it to README.md."""
@@ -165,7 +395,8 @@ async def adhd_dump(request: ADHDDumpRequest):
         {request.content}
         """
         
-        response = client.models.generate_content(
+        response = await run_model(
+            client.models.generate_content,
             model="gemini-3-flash-preview", 
             contents=prompt
         )
@@ -173,9 +404,7 @@ async def adhd_dump(request: ADHDDumpRequest):
 
         # 2. Append to README.md
         readme_path = os.path.join(os.path.dirname(__file__), "..", "..", "README.md")
-        with open(readme_path, "a") as f:
-            f.write(f"\n\n### ADHD Dump Case Log ({datetime.now().strftime('%Y-%m-%d %H:%M')})\n")
-            f.write(f"{structured_note}\n")
+        await run_disk(_append_readme, readme_path, structured_note)
         
         return {"status": "success", "note": structured_note}
     except Exception as e:
@@ -184,23 +413,17 @@ async def adhd_dump(request: ADHDDumpRequest):
 
 
 @app.post("/analyze-contract/", response_model=AnalyzeResponse)
-async def analyze_contract(file: UploadFile = File(...), test_mode: bool = False):
+async def analyze_contract(
+    request: Request,
+    file: UploadFile = File(...),
+    test_mode: bool = False,
+    priority: Optional[str] = None,
+):
     """Upload a PDF and run contract analysis."""
-    if not file.filename:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="File is required.")
-
-    if not file.filename.lower().endswith(".pdf"):
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Only PDF files are supported.")
-
-    temp_dir = tempfile.mkdtemp(prefix="legal-audit-")
-    _, ext = os.path.splitext(file.filename)
-    temp_path = os.path.join(temp_dir, f"{uuid.uuid4()}{ext or '.pdf'}")
+    ticket, temp_dir, temp_path = await _accept_upload(request, file, priority)
 
     try:
-        contents = await file.read()
-        with open(temp_path, "wb") as out_file:
-            out_file.write(contents)
-
+        await ticket.wait()
         result = await analyze_document(temp_path, test_mode=test_mode)
         if not isinstance(result, dict):
             raise RuntimeError(f"Analysis failed to return a valid result: {result!r}")
@@ -216,4 +439,5 @@ async def analyze_contract(file: UploadFile = File(...), test_mode: bool = False
             detail=str(exc),
         ) from exc
     finally:
+        admission.release(ticket)
         shutil.rmtree(temp_dir, ignore_errors=True)
@@ -0,0 +1,157 @@
+"""In-memory store for analyzed documents kept around for follow-up questions."""
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from schemas.contracts import ContractDocument
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", "3600"))
+DEFAULT_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(256 * 1024 * 1024)))
+
+
+@dataclass
+class AnalysisSession:
+    """An analyzed contract: extracted document, findings and follow-up history."""
+
+    document: ContractDocument
+    findings: dict
+    test_mode: bool = False
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    created_at: float = field(default_factory=time.monotonic)
+    last_access: float = field(default_factory=time.monotonic)
+    # Name of the provider-side cached context, if registration succeeded.
+    cache_name: Optional[str] = None
+    # When that cached context expires on the provider side (time.monotonic()).
+    cache_expires_at: Optional[float] = None
+    # Serializes extending / re-creating the cached context across concurrent questions.
+    cache_lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False, compare=False)
+    history: List[Dict[str, str]] = field(default_factory=list)
+    # Approximate memory held by this session, kept up to date by add_turn.
+    size_bytes: int = field(init=False, default=0)
+
+    def __post_init__(self):
+        history_size = sum(len(turn["question"]) + len(turn["answer"]) for turn in self.history)
+        self.size_bytes = self.document.nbytes + len(json.dumps(self.findings)) + history_size
+
+    @property
+    def file_name(self) -> str:
+        return self.document.name
+
+    def add_turn(self, question: str, answer: str) -> int:
+        """Appends a follow-up turn and returns the bytes it added."""
+        self.history.append({"question": question, "answer": answer})
+        added = len(question) + len(answer)
+        self.size_bytes += added
+        return added
+
+
+class SessionStore:
+    """LRU session store with idle-TTL eviction and a total memory cap.
+
+    ``on_evict`` is called for every session that leaves the store (expired,
+    evicted for space or deleted) so that provider-side resources can be freed.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        on_evict: Optional[Callable[[AnalysisSession], None]] = None,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self._sessions: "OrderedDict[str, AnalysisSession]" = OrderedDict()
+        # Running sum of size_bytes over stored sessions.
+        self._total_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, session: AnalysisSession) -> bool:
+        """Whether this exact session is still stored. Does not refresh its idle timer."""
+        return self._sessions.get(session.id) is session
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def add(self, session: AnalysisSession) -> bool:
+        """Stores a session, evicting least recently used ones to stay under the cap.
+
+        Returns False if the session alone exceeds the memory cap.
+        """
+        self.evict_expired()
+        if session.size_bytes > self.max_bytes:
+            logger.warning(f"Session for {session.file_name} exceeds memory cap; not stored.")
+            return False
+        if session.id in self._sessions:
+            self._total_bytes -= self._sessions[session.id].size_bytes
+        self._sessions[session.id] = session
+        self._total_bytes += session.size_bytes
+        self.enforce_cap()
+        return True
+
+    def add_turn(self, session: AnalysisSession, question: str, answer: str) -> None:
+        """Records a follow-up turn on a session and re-applies the memory cap."""
+        added = session.add_turn(question, answer)
+        if session in self:
+            self._total_bytes += added
+            self.enforce_cap()
+
+    def get(self, session_id: str) -> Optional[AnalysisSession]:
+        """Returns a live session and refreshes its idle timer, or None."""
+        self.evict_expired()
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        session.last_access = time.monotonic()
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def remove(self, session_id: str) -> bool:
+        session = self._sessions.pop(session_id, None)
+        if session is None:
+            return False
+        self._total_bytes -= session.size_bytes
+        self._evicted(session, "deleted")
+        return True
+
+    def expires_in(self, session: AnalysisSession) -> float:
+        """Seconds until the session expires if it stays idle."""
+        return max(0.0, session.last_access + self.ttl_seconds - time.monotonic())
+
+    def evict_expired(self) -> None:
+        now = time.monotonic()
+        expired = [
+            session_id
+            for session_id, session in self._sessions.items()
+            if now - session.last_access > self.ttl_seconds
+        ]
+        for session_id in expired:
+            session = self._sessions.pop(session_id)
+            self._total_bytes -= session.size_bytes
+            self._evicted(session, "expired")
+
+    def enforce_cap(self) -> None:
+        """Evicts least recently used sessions until under ``max_bytes``."""
+        while self._total_bytes > self.max_bytes and self._sessions:
+            _, session = self._sessions.popitem(last=False)
+            self._total_bytes -= session.size_bytes
+            self._evicted(session, "memory cap")
+
+    def _evicted(self, session: AnalysisSession, reason: str) -> None:
+        logger.info(f"Session {session.id} ({session.file_name}) evicted: {reason}")
+        if self.on_evict is not None:
+            try:
+                self.on_evict(session)
+            except Exception:
+                logger.exception("Session eviction callback failed")
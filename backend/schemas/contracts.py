@@ -1,11 +1,266 @@
 """Schema definitions for contracts."""
 
+import mmap
+import re
+import struct
+import sys
+from array import array
+from bisect import bisect_right
 from dataclasses import dataclass
+from typing import Iterator, List, Optional, Sequence
 
 
 @dataclass
 class Contract:
     """Contract data schema."""
-    
+
     name: str
     content: str
+
+
+# Section headings such as "Section 5.3 Interest", "ARTICLE IV", "1. Definitions", "5.3 Interest".
+SECTION_HEADING = re.compile(
+    rb"^[ \t]*(?:(?:SECTION|Section|ARTICLE|Article)[ \t]+[0-9IVXLC]+(?:\.[0-9]+)*"
+    rb"|[0-9]+\.(?:[0-9]+\.?)*)[ \t]+\S",
+    re.MULTILINE,
+)
+
+# On-disk layout (little-endian, every block 8-byte aligned):
+#   header   magic, page count, section count, name length, text length
+#   name     UTF-8, padded to 8 bytes
+#   pages    uint64 byte offsets, page count + 1 (last one is the text length)
+#   sections uint64 byte offsets, section count + 1
+#   text     UTF-8 text buffer
+_MAGIC = b"LADOC\x00\x01\x00"
+_HEADER = struct.Struct("<8sQQQQ")
+
+
+def _pad8(n: int) -> int:
+    return (n + 7) & ~7
+
+
+def _text_bounds(mapped: mmap.mmap, path: str):
+    """Validates the header of a mapped document file and returns the text's (start, end)."""
+    if len(mapped) < _HEADER.size:
+        raise ValueError(f"{path} is not a contract document file")
+    magic, page_count, section_count, name_len, text_len = _HEADER.unpack_from(mapped)
+    if magic != _MAGIC:
+        raise ValueError(f"{path} is not a contract document file")
+    start = _HEADER.size + _pad8(name_len) + 8 * (page_count + section_count + 2)
+    if start + text_len > len(mapped):
+        raise ValueError(f"{path} is truncated")
+    return start, start + text_len
+
+
+class ContractDocument:
+    """Page-indexed contract text.
+
+    The text of all pages lives in one contiguous UTF-8 buffer; pages and
+    sections are described by ``uint64`` byte offset tables into it. Page and
+    section accessors return zero-copy ``memoryview`` slices (``*_text``
+    variants decode to ``str``). Indexes are 0-based.
+
+    Documents saved with ``save`` are loaded back with ``load`` by memory
+    mapping the file, so neither the PDF nor the text is parsed again.
+    """
+
+    __slots__ = ("name", "_buffer", "_page_offsets", "_section_offsets", "_mmap")
+
+    def __init__(
+        self,
+        name: str,
+        buffer: memoryview,
+        page_offsets: Sequence[int],
+        section_offsets: Sequence[int],
+        _mmap: Optional[mmap.mmap] = None,
+    ):
+        self.name = name
+        self._buffer = buffer
+        self._page_offsets = page_offsets
+        self._section_offsets = section_offsets
+        self._mmap = _mmap
+
+    @classmethod
+    def from_pages(cls, name: str, pages: List[str]) -> "ContractDocument":
+        """Builds a document from the extracted text of each page."""
+        encoded = [page.encode("utf-8") for page in pages]
+        page_offsets = array("Q", [0])
+        for chunk in encoded:
+            page_offsets.append(page_offsets[-1] + len(chunk))
+        buffer = b"".join(encoded)
+
+        section_offsets = array("Q", (m.start() for m in SECTION_HEADING.finditer(buffer)))
+        section_offsets.append(len(buffer))
+        return cls(name, memoryview(buffer), page_offsets, section_offsets)
+
+    def __reduce__(self):
+        # memoryviews cannot be pickled; ship the buffer and tables as bytes/arrays.
+        return (
+            _rebuild_document,
+            (self.name, bytes(self._buffer), array("Q", self._page_offsets), array("Q", self._section_offsets)),
+        )
+
+    # -- sizes ------------------------------------------------------------
+
+    @property
+    def page_count(self) -> int:
+        return len(self._page_offsets) - 1
+
+    @property
+    def section_count(self) -> int:
+        return len(self._section_offsets) - 1
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the text buffer and offset tables."""
+        return len(self._buffer) + 8 * (len(self._page_offsets) + len(self._section_offsets))
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    def __repr__(self) -> str:
+        return (
+            f"ContractDocument(name={self.name!r}, pages={self.page_count}, "
+            f"sections={self.section_count}, bytes={len(self._buffer)})"
+        )
+
+    # -- zero-copy views --------------------------------------------------
+
+    @property
+    def buffer(self) -> memoryview:
+        """The whole UTF-8 text buffer."""
+        return self._buffer
+
+    def page(self, index: int) -> memoryview:
+        return self._buffer[self._page_offsets[index]:self._page_offsets[index + 1]]
+
+    def section(self, index: int) -> memoryview:
+        return self._buffer[self._section_offsets[index]:self._section_offsets[index + 1]]
+
+    def pages(self) -> Iterator[memoryview]:
+        for index in range(self.page_count):
+            yield self.page(index)
+
+    def page_text(self, index: int) -> str:
+        return str(self.page(index), "utf-8")
+
+    def section_text(self, index: int) -> str:
+        return str(self.section(index), "utf-8")
+
+    def section_title(self, index: int) -> str:
+        """First line of a section, i.e. its heading."""
+        view = self.section(index)
+        end = bytes(view[:256]).find(b"\n")
+        return str(view[:end] if end >= 0 else view[:256], "utf-8", "replace").strip()
+
+    # -- lookup -----------------------------------------------------------
+
+    def page_of(self, offset: int) -> int:
+        """Index of the page containing a byte offset."""
+        if not 0 <= offset < len(self._buffer):
+            raise IndexError(f"offset {offset} outside document")
+        return bisect_right(self._page_offsets, offset, 0, self.page_count) - 1
+
+    def section_of(self, offset: int) -> Optional[int]:
+        """Index of the section containing a byte offset, or None before the first heading."""
+        index = bisect_right(self._section_offsets, offset, 0, self.section_count) - 1
+        return index if index >= 0 else None
+
+    def find(self, quote: str, start: int = 0) -> int:
+        """Byte offset of ``quote`` in the buffer, or -1."""
+        match = re.compile(re.escape(quote.encode("utf-8"))).search(self._buffer, start)
+        return match.start() if match else -1
+
+    def is_blank(self) -> bool:
+        """True if the document has no non-whitespace text."""
+        return re.search(rb"\S", self._buffer) is None
+
+    def to_prompt_text(self) -> str:
+        """The flat text with page markers, as sent to the model."""
+        return "".join(
+            f"\n\n--- [START OF PAGE {index + 1}] ---\n{self.page_text(index)}"
+            for index in range(self.page_count)
+        )
+
+    # -- persistence ------------------------------------------------------
+
+    def save(self, path: str) -> None:
+        """Writes the document in the compact format read by ``load``."""
+        name = self.name.encode("utf-8")
+        pages = array("Q", self._page_offsets)
+        sections = array("Q", self._section_offsets)
+        if sys.byteorder != "little":
+            pages.byteswap()
+            sections.byteswap()
+
+        with open(path, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, self.page_count, self.section_count, len(name), len(self._buffer)))
+            f.write(name.ljust(_pad8(len(name)), b"\x00"))
+            f.write(pages.tobytes())
+            f.write(sections.tobytes())
+            f.write(self._buffer)
+
+    @classmethod
+    def load(cls, path: str) -> "ContractDocument":
+        """Memory-maps a document written by ``save``. Call ``close`` when done.
+
+        The text buffer stays in the map; the (small) offset tables are copied
+        into arrays and validated against the text length.
+        """
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            start, end = _text_bounds(mapped, path)
+            page_count, section_count, name_len = _HEADER.unpack_from(mapped)[1:4]
+            pos = _HEADER.size
+            try:
+                name = mapped[pos:pos + name_len].decode("utf-8")
+            except UnicodeDecodeError as exc:
+                raise ValueError(f"{path} is not a contract document file") from exc
+            pos += _pad8(name_len)
+
+            tables = []
+            for count in (page_count + 1, section_count + 1):
+                table = array("Q")
+                table.frombytes(mapped[pos:pos + 8 * count])
+                if sys.byteorder != "little":
+                    table.byteswap()
+                if table[-1] != end - start or any(a > b for a, b in zip(table, table[1:])):
+                    raise ValueError(f"{path} has a corrupt offset table")
+                tables.append(table)
+                pos += 8 * count
+            if tables[0][0] != 0:
+                raise ValueError(f"{path} has a corrupt offset table")
+        except Exception:
+            # No memoryview of the map exists yet, so it can always be closed here.
+            mapped.close()
+            raise
+        return cls(name, memoryview(mapped)[start:end], tables[0], tables[1], _mmap=mapped)
+
+    def close(self) -> None:
+        """Releases the memory map of a loaded document.
+
+        Raises ``BufferError`` while page or section views are still referenced;
+        the document stays open and usable in that case.
+        """
+        if self._mmap is None:
+            return
+        self._buffer.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            start, end = _text_bounds(self._mmap, self.name)
+            self._buffer = memoryview(self._mmap)[start:end]
+            raise
+        self._mmap = None
+
+    def __enter__(self) -> "ContractDocument":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def _rebuild_document(name: str, buffer: bytes, page_offsets: array, section_offsets: array) -> ContractDocument:
+    """Unpickles a ContractDocument (e.g. one built in a worker process)."""
+    return ContractDocument(name, memoryview(buffer), page_offsets, section_offsets)
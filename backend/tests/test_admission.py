@@ -0,0 +1,229 @@
+"""Tests for admission control, fair queuing and load shedding."""
+import asyncio
+import json
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+import app.main as main
+from app.admission import BULK, INTERACTIVE, AdmissionController, QueueFullError
+from app.contract_analyze import session_store
+from app.sessions import AnalysisSession
+from schemas.contracts import ContractDocument
+
+
+def test_fair_queuing_and_priority():
+    """Interactive work goes first; tenants alternate within a class."""
+
+    async def scenario():
+        controller = AdmissionController(max_concurrent=1, max_bulk_concurrent=1, max_queue=10)
+        running = controller.submit("a", INTERACTIVE)
+        a2 = controller.submit("a", INTERACTIVE)
+        a3 = controller.submit("a", INTERACTIVE)
+        bulk = controller.submit("c", BULK)
+        b1 = controller.submit("b", INTERACTIVE)
+
+        assert running.admitted
+        assert [controller.position(t) for t in (a2, b1, a3, bulk)] == [0, 1, 2, 3]
+
+        admitted = []
+        current = running
+        for _ in range(4):
+            controller.release(current)
+            current = next(t for t in (a2, a3, b1, bulk) if t.admitted and t not in admitted)
+            admitted.append(current)
+        assert admitted == [a2, b1, a3, bulk]
+
+    asyncio.run(scenario())
+
+
+def test_bulk_cap_keeps_interactive_headroom():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=2, max_bulk_concurrent=1)
+        assert controller.submit("a", BULK).admitted
+        assert not controller.submit("a", BULK).admitted
+        assert controller.submit("b", INTERACTIVE).admitted
+
+    asyncio.run(scenario())
+
+
+def test_admission_limits_validated():
+    with pytest.raises(ValueError):
+        AdmissionController(max_concurrent=0)
+
+    async def scenario():
+        controller = AdmissionController(max_concurrent=2, max_bulk_concurrent=0)
+        with pytest.raises(QueueFullError) as exc_info:
+            controller.submit("a", BULK)
+        assert exc_info.value.retry_after >= 1
+        assert controller.submit("a", INTERACTIVE).admitted
+
+    asyncio.run(scenario())
+
+
+def test_saturated_queue_sheds_load():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=1, max_queue=1, service_seconds=10)
+        controller.submit("a", INTERACTIVE)
+        controller.submit("b", INTERACTIVE)
+        with pytest.raises(QueueFullError) as exc_info:
+            controller.submit("c", INTERACTIVE)
+        assert exc_info.value.retry_after >= 10
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_load_test_mode(monkeypatch):
+    """Concurrent test-mode uploads: two run, two queue with position events, one is shed."""
+    controller = AdmissionController(max_concurrent=2, max_bulk_concurrent=1, max_queue=2)
+    monkeypatch.setattr(main, "admission", controller)
+    monkeypatch.setattr(main, "TENANT_API_KEYS", {f"key-{tenant}": tenant for tenant in "abc"})
+    pdf = b"%PDF-1.4\n% Dummy PDF content\n"
+
+    async def upload(client, tenant):
+        return await client.post(
+            "/analyze-contract-stream/?test_mode=true",
+            files={"file": ("sample.pdf", pdf, "application/pdf")},
+            headers={"X-API-Key": f"key-{tenant}"},
+        )
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await asyncio.gather(*(upload(client, tenant) for tenant in "aabbc"))
+
+    responses = asyncio.run(scenario())
+
+    shed = [r for r in responses if r.status_code == 429]
+    served = [r for r in responses if r.status_code == 200]
+    assert len(shed) == 1 and len(served) == 4
+    assert int(shed[0].headers["Retry-After"]) >= 1
+
+    queued = 0
+    for response in served:
+        events = [json.loads(line) for line in response.text.splitlines() if line.strip()]
+        assert any("result" in e for e in events)
+        positions = [e["queue"]["position"] for e in events if "queue" in e]
+        if positions:
+            queued += 1
+            assert positions[0] >= 1 and positions[-1] == 0
+    assert queued == 2
+    assert controller.stats()[INTERACTIVE]["running"] == 0
+
+
+def test_bulk_eta_uses_bulk_slots():
+    """Bulk tickets wait for queued interactive work, then drain through the bulk slots only."""
+
+    async def scenario():
+        controller = AdmissionController(max_concurrent=4, max_bulk_concurrent=1, max_queue=2, service_seconds=10)
+        for _ in range(4):
+            controller.submit("a", INTERACTIVE)
+        last_interactive = controller.submit("b", INTERACTIVE)
+        bulk = controller.submit("c", BULK)
+
+        assert controller.estimated_wait(last_interactive) == 10
+        assert controller.estimated_wait(bulk) == 20
+        with pytest.raises(QueueFullError) as exc_info:
+            controller.submit("d", BULK)
+        assert exc_info.value.retry_after == 30
+
+    asyncio.run(scenario())
+
+
+def test_clients_cannot_raise_bulk_priority(monkeypatch):
+    monkeypatch.setattr(main, "PRIORITY_OVERRIDE_TENANTS", {"trusted"})
+    assert main._resolve_priority("anyone", "interactive", BULK) == BULK
+    assert main._resolve_priority("trusted", "interactive", BULK) == INTERACTIVE
+    assert main._resolve_priority("anyone", "bulk", INTERACTIVE) == BULK
+    assert main._resolve_priority("anyone", None, BULK) == BULK
+
+
+def test_priority_override_needs_api_key(monkeypatch):
+    """The override allowlist matches authenticated tenants only, never a client-supplied name."""
+    monkeypatch.setattr(main, "TENANT_API_KEYS", {"secret": "trusted"})
+    monkeypatch.setattr(main, "PRIORITY_OVERRIDE_TENANTS", {"trusted"})
+    monkeypatch.setattr(main, "BULK_UPLOAD_BYTES", 10)
+    requested = {}
+
+    def submit(tenant, priority=INTERACTIVE):
+        requested[tenant] = priority
+        raise QueueFullError("full", 1)
+
+    monkeypatch.setattr(main.admission, "submit", submit)
+    client = TestClient(main.app)
+    for headers in ({"X-Tenant-ID": "trusted"}, {"X-API-Key": "wrong"}, {"X-API-Key": "secret"}):
+        client.post(
+            "/analyze-contract-stream/?test_mode=true&priority=interactive",
+            files={"file": ("sample.pdf", b"%PDF-1.4\n% Dummy PDF content\n", "application/pdf")},
+            headers=headers,
+        )
+    assert requested == {"client:testclient": BULK, "trusted": INTERACTIVE}
+
+
+class _RecordingController(AdmissionController):
+    """Saturated controller that records the priority of every rejected request."""
+
+    def __init__(self):
+        super().__init__(max_concurrent=1, max_queue=0)
+        self.requested = []
+        self._running[INTERACTIVE] = 1
+
+    def submit(self, tenant, priority=INTERACTIVE):
+        self.requested.append(priority)
+        return super().submit(tenant, priority)
+
+
+def test_upload_classified_server_side(monkeypatch):
+    """A large upload asking for interactive priority is still admitted as bulk."""
+    # An interactive slot is free, the only bulk one is taken, and nothing may queue.
+    controller = _RecordingController()
+    controller.max_concurrent = 2
+    controller._running = {INTERACTIVE: 0, BULK: 1}
+    monkeypatch.setattr(main, "admission", controller)
+    monkeypatch.setattr(main, "BULK_UPLOAD_BYTES", 10)
+
+    client = TestClient(main.app)
+    response = client.post(
+        "/analyze-contract-stream/?test_mode=true&priority=interactive",
+        files={"file": ("sample.pdf", b"%PDF-1.4\n% Dummy PDF content\n", "application/pdf")},
+    )
+    assert response.status_code == 429
+    assert controller.requested == [BULK]
+
+
+def test_follow_up_questions_are_admitted(monkeypatch):
+    controller = _RecordingController()
+    monkeypatch.setattr(main, "admission", controller)
+    session = AnalysisSession(document=ContractDocument.from_pages("a.pdf", ["text"]), findings={}, test_mode=True)
+    session_store.add(session)
+
+    client = TestClient(main.app)
+    response = client.post(f"/api/sessions/{session.id}/ask", json={"question": "Where?"})
+    assert response.status_code == 429
+    assert "Retry-After" in response.headers
+    assert controller.requested == [INTERACTIVE]
+
+
+def test_page_count_classification():
+    pages = b"".join(b"%d 0 obj << /Type /Page /Parent 1 0 R >> endobj\n" % i for i in range(3))
+    tree = b"1 0 obj << /Type /Pages /Count 3 >> endobj\n"
+    assert main._classify_upload(tree + pages) == INTERACTIVE
+    assert main._classify_upload(tree + pages * 20) == BULK
+
+
+def test_shed_before_classifying(monkeypatch):
+    """A saturated queue rejects uploads before they are read, classified or stored."""
+    controller = _RecordingController()
+    monkeypatch.setattr(main, "admission", controller)
+    classified = []
+    monkeypatch.setattr(main, "_classify_upload", lambda contents: classified.append(contents) or INTERACTIVE)
+
+    client = TestClient(main.app)
+    response = client.post(
+        "/analyze-contract-stream/?test_mode=true",
+        files={"file": ("sample.pdf", b"%PDF-1.4\n", "application/pdf")},
+    )
+    assert response.status_code == 429
+    assert "Retry-After" in response.headers
+    assert classified == [] and controller.requested == []
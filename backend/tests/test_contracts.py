@@ -0,0 +1,93 @@
+"""Tests for the page-indexed contract document model."""
+import struct
+
+import pytest
+
+from schemas.contracts import ContractDocument
+
+
+PAGES = [
+    "Cover page\n1. Definitions\n\"Effective Date\" means March 1.\n",
+    "",
+    "5.3 Interest shall accrue as Principal * Rate / 360.\nSection 8.1 Governing law: [__] — São Paulo\n",
+]
+
+
+def test_page_and_section_views():
+    document = ContractDocument.from_pages("sample.pdf", PAGES)
+
+    assert document.page_count == 3
+    assert [document.page_text(i) for i in range(3)] == PAGES
+    assert isinstance(document.page(0), memoryview)
+    assert document.page(0).obj is document.buffer.obj  # slices share one buffer
+    assert [document.section_title(i) for i in range(document.section_count)] == [
+        "1. Definitions",
+        "5.3 Interest shall accrue as Principal * Rate / 360.",
+        "Section 8.1 Governing law: [__] — São Paulo",
+    ]
+
+    offset = document.find("Rate / 360")
+    assert document.page_of(offset) == 2
+    assert document.section_of(offset) == 1
+    assert document.section_of(0) is None
+    assert document.find("not in the contract") == -1
+
+
+def test_prompt_text_keeps_page_markers():
+    document = ContractDocument.from_pages("sample.pdf", PAGES)
+    expected = "".join(f"\n\n--- [START OF PAGE {i + 1}] ---\n{page}" for i, page in enumerate(PAGES))
+    assert document.to_prompt_text() == expected
+    assert ContractDocument.from_pages("blank.pdf", ["", " \n"]).is_blank()
+
+
+def test_save_and_memory_map(tmp_path):
+    document = ContractDocument.from_pages("sample.pdf", PAGES)
+    path = tmp_path / "sample.ladoc"
+    document.save(str(path))
+
+    with ContractDocument.load(str(path)) as loaded:
+        assert loaded.name == "sample.pdf"
+        assert loaded.page_count == document.page_count
+        assert loaded.section_count == document.section_count
+        assert loaded.page_text(2) == PAGES[2]
+        assert loaded.to_prompt_text() == document.to_prompt_text()
+
+
+def test_close_with_outstanding_views_keeps_document_usable(tmp_path):
+    path = tmp_path / "sample.ladoc"
+    ContractDocument.from_pages("sample.pdf", PAGES).save(str(path))
+
+    loaded = ContractDocument.load(str(path))
+    view = loaded.page(0)
+    with pytest.raises(BufferError):
+        loaded.close()
+    assert loaded.page_count == 3
+    assert loaded.page_text(2) == PAGES[2]
+
+    view.release()
+    loaded.close()
+
+
+def test_load_rejects_corrupt_files(tmp_path):
+    good = tmp_path / "sample.ladoc"
+    ContractDocument.from_pages("sample.pdf", PAGES).save(str(good))
+    data = good.read_bytes()
+
+    bad_name = bytearray(data)
+    bad_name[40] = 0xFF  # first byte of the name
+    (tmp_path / "name.ladoc").write_bytes(bytes(bad_name))
+    with pytest.raises(ValueError, match="not a contract document"):
+        ContractDocument.load(str(tmp_path / "name.ladoc"))
+
+    bad_offsets = bytearray(data)
+    struct.pack_into("<Q", bad_offsets, 48 + 8, 10**9)  # second page offset beyond the text
+    (tmp_path / "offsets.ladoc").write_bytes(bytes(bad_offsets))
+    with pytest.raises(ValueError, match="corrupt offset table"):
+        ContractDocument.load(str(tmp_path / "offsets.ladoc"))
+
+
+def test_load_rejects_other_files(tmp_path):
+    path = tmp_path / "sample.pdf"
+    path.write_bytes(b"%PDF-1.4\n% Dummy PDF content\n" * 4)
+    with pytest.raises(ValueError):
+        ContractDocument.load(str(path))
@@ -0,0 +1,77 @@
+"""Tests for the event-loop lag monitor and dedicated executors."""
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from fastapi.testclient import TestClient
+
+from app.executors import run_cpu, run_disk, run_text
+from app.loop_monitor import LoopLagMonitor
+from app.main import app
+
+
+def test_monitor_detects_blocking_callback(caplog):
+    """A synchronous sleep on the loop is recorded as lag and its stack is logged."""
+
+    def block_the_loop():
+        time.sleep(0.3)
+
+    async def scenario():
+        monitor = LoopLagMonitor(interval_ms=20, threshold_ms=100)
+        monitor.start()
+        await asyncio.sleep(0.1)
+        block_the_loop()
+        await asyncio.sleep(0.1)
+        await monitor.stop()
+        return monitor.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["blocked_events"] >= 1
+    assert stats["max_ms"] >= 200
+    assert stats["p50_ms"] <= stats["p99_ms"] <= stats["max_ms"]
+    assert "block_the_loop" in caplog.text
+
+
+def test_blocking_work_runs_off_loop():
+    """PDF parsing runs in worker processes; text and disk work on their own named threads."""
+    loop_thread = threading.get_ident()
+
+    async def scenario():
+        cpu_pid = await run_cpu(os.getpid)
+        text_thread = await run_text(threading.current_thread)
+        disk_thread = await run_disk(threading.current_thread)
+        return cpu_pid, text_thread, disk_thread
+
+    cpu_pid, text_thread, disk_thread = asyncio.run(scenario())
+    assert cpu_pid != os.getpid()
+    assert text_thread.name.startswith("legal-audit-text")
+    assert disk_thread.ident != loop_thread
+    assert disk_thread.name.startswith("legal-audit-disk")
+
+
+def test_crashed_worker_pool_is_replaced():
+    """A worker that dies breaks only the call that killed it; the next call gets a new pool."""
+
+    async def scenario():
+        first_pid = await run_cpu(os.getpid)
+        with pytest.raises(BrokenProcessPool):
+            await run_cpu(os._exit, 1)
+        return first_pid, await run_cpu(os.getpid)
+
+    first_pid, next_pid = asyncio.run(scenario())
+    assert next_pid not in (first_pid, os.getpid())
+
+
+def test_loop_lag_endpoint():
+    """The lag endpoint reports percentiles once the app lifespan has started."""
+    with TestClient(app) as client:
+        response = client.get("/api/loop-lag")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["running"] is True
+    assert {"p50_ms", "p90_ms", "p99_ms", "max_ms"} <= set(body["lag"])
+    assert set(body["executors"]) == {"cpu", "text", "disk", "model", "proc"}
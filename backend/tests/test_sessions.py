@@ -0,0 +1,221 @@
+"""Tests for follow-up Q&A sessions on analyzed contracts."""
+import asyncio
+import json
+import time
+import types
+
+from fastapi.testclient import TestClient
+
+import app.contract_analyze as contract_analyze
+from app.main import app
+from app.sessions import AnalysisSession, SessionStore
+from schemas.contracts import ContractDocument
+
+
+client = TestClient(app)
+
+
+def _ndjson(response):
+    return [json.loads(line) for line in response.text.splitlines() if line.strip()]
+
+
+def test_follow_up_session_test_mode(tmp_path):
+    """A streamed audit opens a session that answers follow-ups without re-upload."""
+    pdf_path = tmp_path / "sample.pdf"
+    pdf_path.write_bytes(b"%PDF-1.4\n% Dummy PDF content\n")
+
+    with pdf_path.open("rb") as f:
+        response = client.post(
+            "/analyze-contract-stream/?test_mode=true",
+            files={"file": ("sample.pdf", f, "application/pdf")},
+        )
+    events = _ndjson(response)
+    session_events = [e["session"] for e in events if "session" in e]
+    assert len(session_events) == 1
+    session_id = session_events[0]["id"]
+
+    response = client.post(
+        f"/api/sessions/{session_id}/ask",
+        json={"question": "Is the 360-day basis used anywhere else?"},
+    )
+    assert response.status_code == 200
+    events = _ndjson(response)
+    chunks = "".join(e["answer_chunk"] for e in events if "answer_chunk" in e)
+    answer = [e["answer"] for e in events if "answer" in e][-1]
+    assert answer["text"] == chunks
+    assert "Section 5.3" in answer["text"]
+
+    body = client.get(f"/api/sessions/{session_id}").json()
+    assert body["file_name"] == "sample.pdf"
+    assert len(body["history"]) == 1
+
+    assert client.delete(f"/api/sessions/{session_id}").status_code == 200
+    assert client.get(f"/api/sessions/{session_id}").status_code == 404
+
+
+def test_unknown_session_returns_404():
+    response = client.post("/api/sessions/missing/ask", json={"question": "Anything?"})
+    assert response.status_code == 404
+
+
+def test_store_ttl_and_memory_cap():
+    """Idle sessions expire and the least recently used are evicted over the cap."""
+    evicted = []
+    store = SessionStore(ttl_seconds=60, max_bytes=300, on_evict=evicted.append)
+
+    first = AnalysisSession(document=ContractDocument.from_pages("a.pdf", ["a" * 100]), findings={})
+    second = AnalysisSession(document=ContractDocument.from_pages("b.pdf", ["b" * 100]), findings={})
+    assert store.add(first) and store.add(second)
+    store.get(first.id)  # first is now most recently used
+    assert store.total_bytes == first.size_bytes + second.size_bytes
+
+    third = AnalysisSession(document=ContractDocument.from_pages("c.pdf", ["c" * 100]), findings={})
+    store.add(third)
+    assert evicted == [second]
+    assert store.get(first.id) is first
+
+    first.last_access -= 120
+    assert store.get(first.id) is None
+    assert evicted[-1] is first
+
+    assert not store.add(AnalysisSession(document=ContractDocument.from_pages("big.pdf", ["x" * 1000]), findings={}))
+
+
+def test_store_tracks_history_bytes():
+    store = SessionStore(ttl_seconds=60, max_bytes=10_000)
+    session = AnalysisSession(document=ContractDocument.from_pages("a.pdf", ["a" * 100]), findings={})
+    store.add(session)
+    before = store.total_bytes
+    store.add_turn(session, "Which page?", "Page 4.")
+    assert store.total_bytes == before + len("Which page?") + len("Page 4.") == session.size_bytes
+    store.remove(session.id)
+    assert store.total_bytes == 0
+
+
+class _FakeCaches:
+    def __init__(self):
+        self.created, self.updated, self.deleted = [], [], []
+        self.fail_update = False
+
+    def create(self, model, config):
+        self.created.append(config["ttl"])
+        return types.SimpleNamespace(name=f"cachedContents/{len(self.created)}")
+
+    def update(self, name, config):
+        if self.fail_update:
+            raise RuntimeError("cache expired")
+        self.updated.append(name)
+
+    def delete(self, name):
+        self.deleted.append(name)
+
+
+class _FakeModels:
+    def __init__(self):
+        self.configs = []
+
+    def generate_content_stream(self, model, contents, config):
+        self.configs.append(config)
+        yield types.SimpleNamespace(text="Section 5.3 only.")
+
+
+def test_active_session_keeps_its_cache(monkeypatch):
+    """The provider cache is extended while a session is in use and re-created once it is gone."""
+    fake = types.SimpleNamespace(caches=_FakeCaches(), models=_FakeModels())
+    monkeypatch.setattr(contract_analyze, "_get_client", lambda: fake)
+
+    async def ask(session):
+        return [json.loads(line) async for line in contract_analyze.ask_session_generator(session, "Where?")]
+
+    async def scenario():
+        document = ContractDocument.from_pages("a.pdf", ["5.3 Interest / 360\n"])
+        session = AnalysisSession(document=document, findings={"errors": []})
+        session.cache_name = await contract_analyze.run_model(contract_analyze._create_context_cache, fake, session)
+        contract_analyze.session_store.add(session)
+
+        await ask(session)
+        assert fake.caches.updated == []  # still fresh
+
+        session.cache_expires_at -= contract_analyze.session_store.ttl_seconds  # half-life passed
+        await ask(session)
+        assert fake.caches.updated == ["cachedContents/1"]
+
+        session.cache_expires_at -= contract_analyze.session_store.ttl_seconds
+        fake.caches.fail_update = True
+        events = await ask(session)
+        assert session.cache_name == "cachedContents/2"
+        assert fake.models.configs[-1] == {"cached_content": "cachedContents/2"}
+        assert events[-1]["answer"]["text"] == "Section 5.3 only."
+        contract_analyze.session_store.remove(session.id)
+
+    asyncio.run(scenario())
+
+
+class _ExpiredCacheModels(_FakeModels):
+    """Fails every request made with the first (expired) cache."""
+
+    def generate_content_stream(self, model, contents, config):
+        if config == {"cached_content": "cachedContents/1"}:
+            raise RuntimeError("cached content not found")
+        return super().generate_content_stream(model, contents, config)
+
+
+async def _wait_for(condition):
+    for _ in range(100):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("condition not met")
+
+
+def test_cache_recreated_once_for_concurrent_questions(monkeypatch):
+    """Concurrent questions on an expired cache re-create it once and delete the old one."""
+    fake = types.SimpleNamespace(caches=_FakeCaches(), models=_ExpiredCacheModels())
+    create = fake.caches.create
+    fake.caches.create = lambda model, config: time.sleep(0.05) or create(model, config)
+    monkeypatch.setattr(contract_analyze, "_get_client", lambda: fake)
+
+    async def ask(session):
+        return [json.loads(line) async for line in contract_analyze.ask_session_generator(session, "Where?")]
+
+    async def scenario():
+        document = ContractDocument.from_pages("a.pdf", ["5.3 Interest / 360\n"])
+        session = AnalysisSession(document=document, findings={"errors": []})
+        session.cache_name = await contract_analyze.run_model(contract_analyze._create_context_cache, fake, session)
+        contract_analyze.session_store.add(session)
+
+        answers = await asyncio.gather(ask(session), ask(session))
+        assert all(events[-1]["answer"]["text"] == "Section 5.3 only." for events in answers)
+        assert len(fake.caches.created) == 2
+        assert session.cache_name == "cachedContents/2"
+        await _wait_for(lambda: fake.caches.deleted == ["cachedContents/1"])
+        contract_analyze.session_store.remove(session.id)
+
+    asyncio.run(scenario())
+
+
+def test_no_cache_kept_for_session_evicted_during_refresh(monkeypatch):
+    """A cache created while its session is being evicted is deleted, not leaked."""
+    fake = types.SimpleNamespace(caches=_FakeCaches(), models=_ExpiredCacheModels())
+
+    async def scenario():
+        document = ContractDocument.from_pages("a.pdf", ["5.3 Interest / 360\n"])
+        session = AnalysisSession(document=document, findings={"errors": []})
+        session.cache_name = await contract_analyze.run_model(contract_analyze._create_context_cache, fake, session)
+        contract_analyze.session_store.add(session)
+
+        create = fake.caches.create
+
+        def create_while_evicting(model, config):
+            contract_analyze.session_store.remove(session.id)
+            return create(model, config)
+
+        fake.caches.create = create_while_evicting
+        monkeypatch.setattr(contract_analyze, "_get_client", lambda: fake)
+
+        events = [json.loads(line) async for line in contract_analyze.ask_session_generator(session, "Where?")]
+        assert events[-1]["answer"]["text"] == "Section 5.3 only."
+        assert session.cache_name is None
+        await _wait_for(lambda: sorted(fake.caches.deleted) == ["cachedContents/1", "cachedContents/2"])
+
+    asyncio.run(scenario())